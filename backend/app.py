@@ -1,28 +1,40 @@
 # Standard library imports
 import os
-from typing import List, Dict, Any, Tuple
 import json
+import hashlib
+import shutil
+import tempfile
+import threading
+from typing import List, Dict, Any, Tuple, Optional, Iterator, TYPE_CHECKING
 from datetime import datetime
 import asyncio
 from functools import lru_cache
 from pathlib import Path
 import re
+import math
 
-# Local imports
-from text_extractor import TextExtractor
-from table_extractor import TableExtractor
-from visual_extractor import VisualExtractor
+import orjson
 
 # Machine Learning imports
-from langchain_community.vectorstores import FAISS
-from langchain_community.embeddings import HuggingFaceEmbeddings
+# Heavy dependencies (torch, faiss, OpenCV, Tesseract) are imported lazily
+# by the accessors below so server start-up and idle workers stay light.
+import numpy as np
 from langchain.text_splitter import RecursiveCharacterTextSplitter
-from langchain_groq import ChatGroq
+from langchain_core.documents import Document
 from langchain.chains import ConversationalRetrievalChain
-from langchain.memory import ConversationBufferMemory
+from langchain.memory import ConversationBufferWindowMemory
 from langchain.prompts import PromptTemplate
 from dotenv import load_dotenv
 
+if TYPE_CHECKING:
+    import faiss
+    from langchain_groq import ChatGroq
+    from langchain_community.vectorstores import FAISS
+    from embeddings import BatchedEmbeddings
+    from text_extractor import TextExtractor
+    from table_extractor import TableExtractor
+    from visual_extractor import VisualExtractor
+
 # Load environment variables
 load_dotenv()
 
@@ -33,27 +45,133 @@ if not GROQ_API_KEY:
 
 MODEL_NAME = "meta-llama/llama-4-scout-17b-16e-instruct"
 MAX_FILE_SIZE = 10 * 1024 * 1024  # 10 MB
-EMBEDDING_MODEL = "all-MiniLM-L6-v2"
-
-# Initialize extractors
-text_extractor = TextExtractor()
-table_extractor = TableExtractor(MODEL_NAME, GROQ_API_KEY)
-visual_extractor = VisualExtractor()
+EMBEDDING_MODEL = "sentence-transformers/all-MiniLM-L6-v2"
+EMBEDDING_BATCH_SIZE = 64
+IVF_MIN_VECTORS = 50_000  # Switch from a flat to an inverted-file index above this size
+IVF_NPROBE = 16
+CHAT_HISTORY_TURNS = 8  # Question/answer pairs sent back to the LLM
 
 # Optimization settings
 CHUNK_SIZE = 1500  # Increased for better context
 CHUNK_OVERLAP = 200  # Increased for better continuity
 CACHE_DIR = Path("cache")
 VECTOR_CACHE = CACHE_DIR / "vectors"
+EMBEDDING_CACHE = CACHE_DIR / "onnx-miniLM"  # int8 ONNX export of EMBEDDING_MODEL
+EXTRACTED_DATA_FILE = "extracted_data.json"
+# Folded into cache keys, with the extractor settings, so entries built with other
+# settings are never reused; update the format tag whenever the index layout,
+# stored metadata or extraction logic changes.
+INDEX_SETTINGS = {
+    "embedding_model": EMBEDDING_MODEL,
+    "embedding_file": "model.int8.onnx",
+    "index": "sq8",
+    "metric": "inner_product",
+    "chunk_size": CHUNK_SIZE,
+    "chunk_overlap": CHUNK_OVERLAP,
+    "format": "metadata-v2"
+}
+
+# Fallback for sources indexed without page metadata
+_PAGE_RE = re.compile(r"page (\d+)")
 
 # Create cache directories
 CACHE_DIR.mkdir(exist_ok=True)
 VECTOR_CACHE.mkdir(exist_ok=True)
 
-@lru_cache(maxsize=100)
-def get_embeddings():
-    """Cache the embedding model."""
-    return HuggingFaceEmbeddings(model_name=EMBEDDING_MODEL)
+def dump_json(data: Any, indent: bool = False) -> bytes:
+    """Serialize to UTF-8 JSON bytes with orjson.
+
+    Falls back to the standard library for values orjson rejects, such as
+    integers wider than 64 bits in LLM-produced table data.
+    """
+    option = orjson.OPT_NON_STR_KEYS | (orjson.OPT_INDENT_2 if indent else 0)
+    try:
+        return orjson.dumps(data, option=option)
+    except orjson.JSONEncodeError:
+        return json.dumps(data, ensure_ascii=False, indent=2 if indent else None).encode("utf-8")
+
+@lru_cache(maxsize=1)
+def get_llm() -> "ChatGroq":
+    """Create the shared Groq client, reusing HTTP/2 connections across calls."""
+    import httpx
+    from langchain_groq import ChatGroq
+    return ChatGroq(
+        temperature=0.2,
+        model_name=MODEL_NAME,
+        groq_api_key=GROQ_API_KEY,
+        http_async_client=httpx.AsyncClient(
+            http2=True,
+            limits=httpx.Limits(max_connections=32, max_keepalive_connections=16)
+        )
+    )
+
+@lru_cache(maxsize=1)
+def get_text_extractor() -> "TextExtractor":
+    """Create the text extractor on first use."""
+    from text_extractor import TextExtractor
+    return TextExtractor()
+
+@lru_cache(maxsize=1)
+def get_table_extractor() -> "TableExtractor":
+    """Create the table extractor on first use."""
+    from table_extractor import TableExtractor
+    return TableExtractor(MODEL_NAME, GROQ_API_KEY, llm=get_llm())
+
+@lru_cache(maxsize=1)
+def get_visual_extractor() -> "VisualExtractor":
+    """Create the visual extractor on first use."""
+    from visual_extractor import VisualExtractor
+    return VisualExtractor()
+
+@lru_cache(maxsize=1)
+def get_cache_version() -> str:
+    """Hash every setting cached entries depend on, creating the extractors to read theirs."""
+    settings = {
+        "index": INDEX_SETTINGS,
+        "tables": get_table_extractor().settings,
+        "visual": get_visual_extractor().settings
+    }
+    return hashlib.sha256(json.dumps(settings, sort_keys=True).encode()).hexdigest()[:16]
+
+_embeddings_lock = threading.Lock()
+
+@lru_cache(maxsize=1)
+def _load_embeddings() -> "BatchedEmbeddings":
+    from embeddings import BatchedEmbeddings
+    return BatchedEmbeddings(EMBEDDING_MODEL, EMBEDDING_CACHE, EMBEDDING_BATCH_SIZE)
+
+def export_embedding_model() -> None:
+    """Export the embedding model to int8 ONNX unless an earlier run has, without loading it."""
+    from embeddings import export_quantized_model
+    export_quantized_model(EMBEDDING_MODEL, EMBEDDING_CACHE)
+
+def get_embeddings() -> "BatchedEmbeddings":
+    """Cache the embedding model, exporting it to int8 ONNX on first use.
+
+    The first call can take minutes, so call it from a worker thread; the lock
+    keeps concurrent first calls from exporting the model twice.
+    """
+    with _embeddings_lock:
+        return _load_embeddings()
+
+def build_index(vectors: np.ndarray) -> "faiss.Index":
+    """Build an 8-bit scalar-quantized inner-product FAISS index for the given vectors.
+
+    Vectors are normalized in place, so inner product equals cosine similarity.
+    """
+    import faiss
+    faiss.normalize_L2(vectors)
+    n, d = vectors.shape
+    if n >= IVF_MIN_VECTORS:
+        nlist = int(math.sqrt(n))
+        index = faiss.IndexIVFScalarQuantizer(
+            faiss.IndexFlatIP(d), d, nlist, faiss.ScalarQuantizer.QT_8bit, faiss.METRIC_INNER_PRODUCT
+        )
+        index.nprobe = IVF_NPROBE
+    else:
+        index = faiss.IndexScalarQuantizer(d, faiss.ScalarQuantizer.QT_8bit, faiss.METRIC_INNER_PRODUCT)
+    index.train(vectors)
+    return index
 
 class PDFProcessor:
     """Comprehensive PDF processing with structured content extraction."""
@@ -74,24 +192,49 @@ class PDFProcessor:
         if file_size > MAX_FILE_SIZE:
             raise ValueError(f"File size ({file_size} bytes) exceeds maximum allowed size ({MAX_FILE_SIZE} bytes)")
 
-    async def process_pdf(self, file_path: str) -> Dict[str, Any]:
-        """Process PDF and extract all content into structured format."""
+    async def process_pdf(self, file_path: str, digest: Optional[str] = None) -> Dict[str, Any]:
+        """Process PDF and extract all content into structured format.
+
+        When a content digest is given, results are cached under VECTOR_CACHE
+        and identical uploads skip extraction and embedding entirely.
+        """
         self.validate_pdf(file_path)
+        cache_path = VECTOR_CACHE / f"{digest}-{get_cache_version()}" if digest else None
         
         try:
-            # Extract content in parallel for efficiency
-            text_content, table_content, visual_content = await asyncio.gather(
-                text_extractor.async_extract(file_path),
-                table_extractor.async_extract(file_path),
-                visual_extractor.async_extract(file_path)
-            )
+            if cache_path and (cache_path / EXTRACTED_DATA_FILE).exists():
+                extracted_data = await asyncio.to_thread(self._load_cached, cache_path, file_path)
+                self.chain = self._create_qa_chain()
+                return extracted_data
+            
+            from pdf_utils import open_pdf, close_pdf
+            
+            # Read and parse the file once; PDFium serves both text and page renders
+            pdf_bytes = Path(file_path).read_bytes()
+            # PDFium calls wait on a shared lock, so keep them off the event loop
+            pdf = await asyncio.to_thread(open_pdf, pdf_bytes)
+            try:
+                # Extract content in parallel for efficiency; wait for every extractor,
+                # even after a failure, so none still uses the document once it is closed
+                results = await asyncio.gather(
+                    get_text_extractor().async_extract(pdf),
+                    get_table_extractor().async_extract(pdf_bytes),
+                    get_visual_extractor().async_extract(pdf),
+                    return_exceptions=True
+                )
+            finally:
+                await asyncio.to_thread(close_pdf, pdf)
+            for result in results:
+                if isinstance(result, BaseException):
+                    raise result
+            text_content, table_content, visual_content = results
             
             # Combine all extracted data in structured format
             extracted_data = {
                 "metadata": {
                     "filename": os.path.basename(file_path),
                     "processed_at": datetime.now().isoformat(),
-                    "file_size": os.path.getsize(file_path),
+                    "file_size": len(pdf_bytes),
                     "total_pages": text_content.get("total_pages", 0)
                 },
                 "text": text_content,
@@ -103,29 +246,129 @@ class PDFProcessor:
             self.vectorstore = await self._create_vectorstore(extracted_data)
             self.chain = self._create_qa_chain()
             
+            # Failures such as a Groq outage may not recur, so never cache degraded results
+            if cache_path and self._is_complete(table_content, visual_content):
+                # Writing the index and docstore is blocking file I/O
+                await asyncio.to_thread(self._save_cached, cache_path, extracted_data)
+            
             return extracted_data
             
         except Exception as e:
             raise ValueError(f"Error processing PDF: {str(e)}")
 
-    async def _create_vectorstore(self, extracted_data: Dict[str, Any]) -> FAISS:
+    def _is_complete(self, table_content: Any, visual_content: Any) -> bool:
+        """Whether every extractor succeeded and every table was structured."""
+        if not isinstance(table_content, dict) or not isinstance(visual_content, dict):
+            return False
+        if "error" in table_content or table_content.get("unstructured_tables"):
+            return False
+        statistics = visual_content.get("statistics", {})
+        return "error" not in statistics and not statistics.get("failed_pages")
+
+    def _load_cached(self, cache_path: Path, file_path: str) -> Dict[str, Any]:
+        """Load the vectorstore and extracted data saved for an identical PDF."""
+        from langchain_community.vectorstores import FAISS
+        from langchain_community.vectorstores.utils import DistanceStrategy
+        
+        self.vectorstore = FAISS.load_local(
+            str(cache_path),
+            get_embeddings(),
+            allow_dangerous_deserialization=True,
+            distance_strategy=DistanceStrategy.MAX_INNER_PRODUCT
+        )
+        # Standard json keeps integers wider than 64 bits exact; orjson turns them into floats
+        extracted_data = json.loads((cache_path / EXTRACTED_DATA_FILE).read_bytes())
+        
+        # Refresh upload-specific metadata
+        extracted_data["metadata"]["filename"] = os.path.basename(file_path)
+        extracted_data["metadata"]["processed_at"] = datetime.now().isoformat()
+        return extracted_data
+
+    def _save_cached(self, cache_path: Path, extracted_data: Dict[str, Any]) -> None:
+        """Persist the vectorstore and extracted data keyed by content digest.
+
+        The entry is written to a temporary directory and moved into place in one
+        step, so concurrent workers never see or mix partial entries.
+        """
+        tmp_path = Path(tempfile.mkdtemp(dir=VECTOR_CACHE, prefix=".tmp-"))
+        try:
+            self.vectorstore.save_local(str(tmp_path))
+            (tmp_path / EXTRACTED_DATA_FILE).write_bytes(dump_json(extracted_data))
+            # Fails if another worker already stored this entry; theirs is kept
+            os.replace(tmp_path, cache_path)
+        except Exception as e:
+            print(f"Error saving vector cache: {str(e)}")
+        finally:
+            shutil.rmtree(tmp_path, ignore_errors=True)
+
+    async def _create_vectorstore(self, extracted_data: Dict[str, Any]) -> "FAISS":
         """Create a vectorstore from the extracted content for efficient QA."""
-        texts = []
+        from langchain_community.vectorstores import FAISS
+        from langchain_community.docstore.in_memory import InMemoryDocstore
+        from langchain_community.vectorstores.utils import DistanceStrategy
+        
+        # Split each source item on its own, each chunk inheriting its metadata
+        text_splitter = RecursiveCharacterTextSplitter(
+            chunk_size=CHUNK_SIZE,
+            chunk_overlap=CHUNK_OVERLAP,
+            length_function=len
+        )
+        documents: List[Document] = []
+        for text, metadata in self._iter_sources(extracted_data):
+            documents.extend(text_splitter.create_documents([text], metadatas=[metadata]))
         
-        # Add text content
+        # Embedding is CPU-bound; run it off the event loop so other sessions stay responsive
+        embeddings = await asyncio.to_thread(get_embeddings)
+        vectors = await asyncio.to_thread(self._embed_documents, embeddings, documents)
+        
+        # Create and return the vector store
+        vectorstore = FAISS(
+            embedding_function=embeddings,
+            index=build_index(vectors),
+            docstore=InMemoryDocstore(),
+            index_to_docstore_id={},
+            distance_strategy=DistanceStrategy.MAX_INNER_PRODUCT
+        )
+        vectorstore.add_embeddings(
+            zip((doc.page_content for doc in documents), vectors),
+            metadatas=[doc.metadata for doc in documents]
+        )
+        return vectorstore
+
+    def _embed_documents(self, embeddings: "BatchedEmbeddings", documents: List[Document]) -> np.ndarray:
+        """Embed documents in mini-batches straight into one preallocated matrix.
+
+        Batches are formed in length order so each pads to a similar size, and each
+        result is written back to its chunk's position so document order is preserved.
+        """
+        vectors = np.empty((len(documents), embeddings.dimension), dtype=np.float32)
+        order = np.argsort([len(doc.page_content) for doc in documents], kind="stable")
+        for start in range(0, len(order), EMBEDDING_BATCH_SIZE):
+            batch = order[start:start + EMBEDDING_BATCH_SIZE]
+            vectors[batch] = embeddings.encode([documents[i].page_content for i in batch])
+        return vectors
+
+    def _iter_sources(self, extracted_data: Dict[str, Any]) -> Iterator[Tuple[str, Dict[str, Any]]]:
+        """Yield (text, metadata) for every piece of extracted content."""
+        # Add text content, grouped by page so chunks keep their page number
+        page_texts: Dict[Any, List[str]] = {}
         if "content" in extracted_data.get("text", {}):
             for item in extracted_data["text"]["content"]:
                 if isinstance(item, dict) and "type" in item and "text" in item:
                     if item["type"] in ["paragraph", "heading"]:
-                        texts.append(f"[{item['type'].capitalize()}] {item['text']}")
+                        page_texts.setdefault(item.get("page_number"), []).append(
+                            f"[{item['type'].capitalize()}] {item['text']}"
+                        )
+        for page_number, page_items in page_texts.items():
+            yield "\n\n".join(page_items), {"type": "text", "page": page_number}
         
         # Add table content
         for table in extracted_data.get("tables", []):
             if isinstance(table, dict):
                 table_text = f"[Table on page {table.get('page_number', 'unknown')}] "
                 if "structured_data" in table:
-                    table_text += json.dumps(table['structured_data'])
-                    texts.append(table_text)
+                    table_text += dump_json(table['structured_data']).decode()
+                    yield table_text, {"type": "table", "page": table.get("page_number")}
         
         # Add visual content
         visual_elements = extracted_data.get("visual_elements", {})
@@ -135,35 +378,18 @@ class PDFProcessor:
                 graph_text += f"Type: {graph.get('type', 'unknown')}. "
                 if "extracted_text" in graph:
                     graph_text += f"Extracted text: {graph['extracted_text']}"
-                texts.append(graph_text)
+                yield graph_text, {"type": "graph", "page": graph.get("page_number")}
         
         for image in visual_elements.get("images", []):
             if isinstance(image, dict) and "extracted_text" in image:
                 image_text = f"[Image on page {image.get('page_number', 'unknown')}] "
                 image_text += image["extracted_text"]
-                texts.append(image_text)
-        
-        # Create text chunks
-        text_splitter = RecursiveCharacterTextSplitter(
-            chunk_size=CHUNK_SIZE,
-            chunk_overlap=CHUNK_OVERLAP,
-            length_function=len
-        )
-        chunks = text_splitter.split_text("\n\n".join(texts))
-        
-        # Create and return the vector store
-        embeddings = get_embeddings()
-        return FAISS.from_texts(chunks, embeddings)
+                yield image_text, {"type": "image", "page": image.get("page_number")}
         
     def _create_qa_chain(self) -> ConversationalRetrievalChain:
         """Create a conversation chain for QA."""
-        llm = ChatGroq(
-            temperature=0.2,
-            model_name=MODEL_NAME,
-            groq_api_key=GROQ_API_KEY
-        )
-        
-        memory = ConversationBufferMemory(
+        memory = ConversationBufferWindowMemory(
+            k=CHAT_HISTORY_TURNS,
             memory_key="chat_history",
             return_messages=True,
             output_key='answer'
@@ -187,7 +413,7 @@ Answer:"""
         )
         
         return ConversationalRetrievalChain.from_llm(
-            llm=llm,
+            llm=get_llm(),
             retriever=self.vectorstore.as_retriever(
                 search_kwargs={"k": 4}
             ),
@@ -213,22 +439,14 @@ Answer:"""
         for doc in result.get("source_documents", []):
             source_text = doc.page_content
             
-            # Determine source type and location
-            if source_text.startswith("[Table"):
-                source_type = "table"
-            elif source_text.startswith("[Graph"):
-                source_type = "graph"
-            elif source_text.startswith("[Image"):
-                source_type = "image"
-            else:
-                source_type = "text"
-            
-            # Extract page number if available
-            page_match = re.search(r"page (\d+)", source_text)
-            page_number = int(page_match.group(1)) if page_match else None
+            # Source type and location are recorded at ingest time
+            page_number = doc.metadata.get("page")
+            if page_number is None:
+                page_match = _PAGE_RE.search(source_text)
+                page_number = int(page_match.group(1)) if page_match else None
             
             sources.append({
-                "type": source_type,
+                "type": doc.metadata.get("type", "text"),
                 "page": page_number,
                 "content": source_text
             })
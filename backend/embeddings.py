@@ -0,0 +1,98 @@
+"""Module for batched sentence embeddings used by the vector store."""
+
+import os
+import shutil
+import tempfile
+from pathlib import Path
+from typing import List
+import numpy as np
+from langchain_core.embeddings import Embeddings
+
+QUANTIZED_MODEL_FILE = "model.int8.onnx"
+
+def export_quantized_model(model_name: str, export_dir: Path) -> None:
+    """Export the model to ONNX and quantize its weights to int8, once per cache directory.
+
+    The export is built in a temporary directory and moved into place in one step,
+    so an interrupted export is never mistaken for a finished one and concurrent
+    workers keep whichever export lands first.
+    """
+    if (export_dir / QUANTIZED_MODEL_FILE).exists():
+        return
+    # Heavy imports (optimum pulls in torch) wait until an export is actually needed
+    from onnxruntime.quantization import quantize_dynamic, QuantType
+    from optimum.onnxruntime import ORTModelForFeatureExtraction
+    from transformers import AutoTokenizer
+
+    export_dir.parent.mkdir(parents=True, exist_ok=True)
+    tmp_dir = Path(tempfile.mkdtemp(dir=export_dir.parent, prefix=".tmp-"))
+    try:
+        ORTModelForFeatureExtraction.from_pretrained(model_name, export=True).save_pretrained(tmp_dir)
+        AutoTokenizer.from_pretrained(model_name).save_pretrained(tmp_dir)
+        quantize_dynamic(
+            str(tmp_dir / "model.onnx"),
+            str(tmp_dir / QUANTIZED_MODEL_FILE),
+            weight_type=QuantType.QUInt8
+        )
+        if export_dir.exists() and not (export_dir / QUANTIZED_MODEL_FILE).exists():
+            # Left behind by an export that was interrupted before it was atomic
+            shutil.rmtree(export_dir, ignore_errors=True)
+        try:
+            os.replace(tmp_dir, export_dir)
+        except OSError:
+            # Another worker finished first; keep its export
+            if not (export_dir / QUANTIZED_MODEL_FILE).exists():
+                raise
+    finally:
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+
+class BatchedEmbeddings(Embeddings):
+    """LangChain-compatible sentence embeddings from an int8 ONNX Runtime model."""
+
+    def __init__(self, model_name: str, export_dir: Path, batch_size: int = 64, max_length: int = 256):
+        """Load the quantized export of the model, creating it on first use."""
+        from optimum.onnxruntime import ORTModelForFeatureExtraction
+        from transformers import AutoTokenizer
+
+        self.batch_size = batch_size
+        self.max_length = max_length
+        export_quantized_model(model_name, export_dir)
+        self.tokenizer = AutoTokenizer.from_pretrained(export_dir)
+        self.model = ORTModelForFeatureExtraction.from_pretrained(
+            export_dir,
+            file_name=QUANTIZED_MODEL_FILE,
+            provider="CPUExecutionProvider"
+        )
+
+    @property
+    def dimension(self) -> int:
+        """Size of the produced embedding vectors."""
+        return self.model.config.hidden_size
+
+    def encode(self, texts: List[str]) -> np.ndarray:
+        """Encode texts in explicit batches into unit-length float32 vectors."""
+        vectors = np.empty((len(texts), self.dimension), dtype=np.float32)
+        for start in range(0, len(texts), self.batch_size):
+            inputs = self.tokenizer(
+                texts[start:start + self.batch_size],
+                padding=True,
+                truncation=True,
+                max_length=self.max_length,
+                return_tensors="np"
+            )
+            token_embeddings = np.asarray(self.model(**inputs).last_hidden_state)
+
+            # Mean-pool over real tokens, then normalize as sentence-transformers does
+            mask = inputs["attention_mask"][..., None].astype(np.float32)
+            pooled = (token_embeddings * mask).sum(axis=1) / np.clip(mask.sum(axis=1), 1e-9, None)
+            norms = np.linalg.norm(pooled, axis=1, keepdims=True)
+            vectors[start:start + len(pooled)] = pooled / np.clip(norms, 1e-12, None)
+        return vectors
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        """Embed a list of documents."""
+        return self.encode(texts).tolist()
+
+    def embed_query(self, text: str) -> List[float]:
+        """Embed a single query."""
+        return self.encode([text])[0].tolist()
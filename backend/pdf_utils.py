@@ -0,0 +1,28 @@
+"""Shared helpers for reading PDFs with PDFium."""
+
+import threading
+from typing import TYPE_CHECKING
+
+if TYPE_CHECKING:
+    import pypdfium2 as pdfium
+
+# PDFium is not thread-safe, not even across separate documents, so every
+# call into pypdfium2 must hold this lock.
+PDFIUM_LOCK = threading.Lock()
+
+def open_pdf(pdf_bytes: bytes) -> "pdfium.PdfDocument":
+    """Parse an in-memory PDF once so every extractor can share it."""
+    import pypdfium2 as pdfium
+    
+    with PDFIUM_LOCK:
+        return pdfium.PdfDocument(pdf_bytes)
+
+def close_pdf(pdf: "pdfium.PdfDocument") -> None:
+    """Release a document returned by open_pdf."""
+    with PDFIUM_LOCK:
+        pdf.close()
+
+def page_count(pdf: "pdfium.PdfDocument") -> int:
+    """Number of pages in a PDFium document."""
+    with PDFIUM_LOCK:
+        return len(pdf)
@@ -1,16 +1,20 @@
 """FastAPI backend for PDF processing and question answering."""
 
 import os
+import hashlib
 import tempfile
-from typing import Dict, Any, List
+import uuid
+from collections import OrderedDict
+from typing import Dict, Any, List, Optional
 from datetime import datetime
+from pathlib import Path
 import asyncio
 
-from fastapi import FastAPI, File, UploadFile, HTTPException
+from fastapi import FastAPI, File, UploadFile, HTTPException, Header, Response
 from fastapi.middleware.cors import CORSMiddleware
 from pydantic import BaseModel
 
-from app import PDFProcessor
+from app import PDFProcessor, CHAT_HISTORY_TURNS, dump_json, export_embedding_model
 
 # Initialize FastAPI app
 app = FastAPI(title="PDF Chat API")
@@ -21,23 +25,43 @@ app.add_middleware(
     allow_origins=["*"],
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["X-Session-Id"],
 )
 
-# Global state (one PDF at a time per session)
-pdf_processor = PDFProcessor()
-chat_history: List[tuple[str, str]] = []
+MAX_SESSIONS = 32  # Least recently used sessions are dropped beyond this
+
+class Session:
+    """State for one uploaded PDF and its conversation."""
+    
+    def __init__(self, pdf_processor: PDFProcessor):
+        self.pdf_processor = pdf_processor
+        self.chat_history: List[tuple[str, str]] = []
+        # Serializes questions within a session; sessions run concurrently
+        self.lock = asyncio.Lock()
+
+# Sessions keyed by the id returned from /upload, in least recently used order
+SESSIONS: "OrderedDict[str, Session]" = OrderedDict()
 
 # Create directory for storing extracted data
 STORAGE_DIR = os.path.join(os.path.dirname(__file__), "extracted_data")
 os.makedirs(STORAGE_DIR, exist_ok=True)
 
+@app.on_event("startup")
+async def export_embeddings():
+    """Export the embedding model on the first run; the model itself loads on first use."""
+    try:
+        await asyncio.to_thread(export_embedding_model)
+    except Exception as e:
+        # Uploads retry the export off the event loop
+        print(f"Error exporting embedding model: {str(e)}")
+
 class ChatRequest(BaseModel):
     """Request model for chat endpoint."""
     question: str
 
 @app.post("/upload")
-async def upload_pdf_endpoint(file: UploadFile = File(...)):
-    """Handle PDF upload and processing."""
+async def upload_pdf_endpoint(response: Response, file: UploadFile = File(...)):
+    """Handle PDF upload and processing in a new session."""
     if not file.filename.lower().endswith(".pdf"):
         raise HTTPException(status_code=400, detail="Only PDF files are supported.")
 
@@ -45,6 +69,7 @@ async def upload_pdf_endpoint(file: UploadFile = File(...)):
     MAX_SIZE = 10 * 1024 * 1024  # 10 MB
     file_size = 0
     tmp_path = None
+    hasher = hashlib.sha256()
     
     try:
         # Create temp file with proper cleanup
@@ -58,24 +83,28 @@ async def upload_pdf_endpoint(file: UploadFile = File(...)):
                 if file_size > MAX_SIZE:
                     raise HTTPException(status_code=413, detail="File too large. Maximum size is 10MB.")
                 tmp.write(chunk)
+                hasher.update(chunk)
                 await asyncio.sleep(0)  # Allow other tasks to run
 
         # Process PDF and extract content
-        global pdf_processor, chat_history
-        extracted_data = await pdf_processor.process_pdf(tmp_path)
-        chat_history = []
+        pdf_processor = PDFProcessor()
+        extracted_data = await pdf_processor.process_pdf(tmp_path, hasher.hexdigest())
 
         if "error" in extracted_data:
             raise HTTPException(status_code=500, detail=extracted_data["error"])
 
+        session_id = uuid.uuid4().hex
+        SESSIONS[session_id] = Session(pdf_processor)
+        while len(SESSIONS) > MAX_SESSIONS:
+            SESSIONS.popitem(last=False)
+        response.headers["X-Session-Id"] = session_id
+
         # Save extracted data
         timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
         json_filename = f"{os.path.splitext(file.filename)[0]}_{timestamp}.json"
         json_path = os.path.join(STORAGE_DIR, json_filename)
 
-        with open(json_path, 'w', encoding='utf-8') as f:
-            import json
-            json.dump(extracted_data, f, ensure_ascii=False, indent=2)
+        Path(json_path).write_bytes(dump_json(extracted_data, indent=True))
 
         # Prepare detailed content summary
         text_stats = extracted_data.get("text", {}).get("statistics", {})
@@ -85,6 +114,7 @@ async def upload_pdf_endpoint(file: UploadFile = File(...)):
         return {
             "status": "success",
             "message": "PDF processed successfully. Ready for questions.",
+            "session_id": session_id,
             "extracted_data_path": json_path,
             "content_summary": {
                 "metadata": extracted_data.get("metadata", {}),
@@ -126,17 +156,23 @@ async def upload_pdf_endpoint(file: UploadFile = File(...)):
                 print(f"Error cleaning up temporary files: {str(e)}")
 
 @app.post("/chat")
-async def chat_endpoint(payload: ChatRequest):
-    """Answer questions about the processed PDF."""
-    global pdf_processor, chat_history
-    
+async def chat_endpoint(payload: ChatRequest, x_session_id: Optional[str] = Header(None)):
+    """Answer questions about the PDF processed in the caller's session."""
     question = payload.question.strip()
     if not question:
         raise HTTPException(status_code=400, detail="Question cannot be empty.")
 
+    session = SESSIONS.get(x_session_id) if x_session_id else None
+    if session is None:
+        raise HTTPException(status_code=400, detail="No PDF has been processed yet. Please upload a PDF first.")
+    SESSIONS.move_to_end(x_session_id)
+
     try:
-        response = await pdf_processor.ask_question(question, chat_history)
-        chat_history.append((question, response["answer"]))
+        async with session.lock:
+            response = await session.pdf_processor.ask_question(question, session.chat_history)
+            session.chat_history.append((question, response["answer"]))
+            # Keep a rolling window so prompts do not grow with every turn
+            session.chat_history[:] = session.chat_history[-CHAT_HISTORY_TURNS:]
         return response
     except ValueError as e:
         raise HTTPException(status_code=400, detail=str(e))
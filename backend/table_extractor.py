@@ -1,19 +1,39 @@
 """Module for extracting and structuring table content from PDFs."""
 
+import io
 import os
 import json
-from typing import Dict, Any, List
+import asyncio
+from typing import Dict, Any, List, Optional, Tuple
 import pdfplumber
 from langchain_groq import ChatGroq
 
+TABLE_PROMPT = """Please analyze this table data and convert it into a structured format.
+            Focus on identifying headers and organizing the data appropriately.
+
+            Table Data:
+            {table_text}
+
+            Convert this into a structured format with clear headers and data rows.
+            Return only the JSON structure without any explanation."""
+
+TABLE_BATCH_PROMPT = """Please analyze each of the following {count} tables and convert them into a structured format.
+            Focus on identifying headers and organizing the data appropriately.
+
+            {numbered_tables}
+
+            Convert each table into a structured format with clear headers and data rows.
+            Return only a JSON array of length {count}, where element i is the JSON structure for Table i+1, without any explanation."""
+
 class TableExtractor:
     """Handles extraction and structuring of table content from PDFs."""
     
-    def __init__(self, model_name: str, groq_api_key: str):
-        """Initialize with model configuration."""
+    def __init__(self, model_name: str, groq_api_key: str, batch_size: int = 6, llm: Optional[ChatGroq] = None):
+        """Initialize with model configuration, optionally sharing an existing client."""
         self.model_name = model_name
         self.groq_api_key = groq_api_key
-        self.llm = ChatGroq(
+        self.batch_size = batch_size  # Tables structured per LLM call
+        self.llm = llm or ChatGroq(
             temperature=0.2,
             model_name=model_name,
             groq_api_key=groq_api_key
@@ -30,41 +50,73 @@ class TableExtractor:
             'intersection_y_tolerance': 3
         }
 
-    async def async_extract(self, file_path: str) -> Dict[str, Any]:
-        """Extract and structure table content using LLM."""
+    @property
+    def settings(self) -> Dict[str, Any]:
+        """Settings that shape the extracted tables, for cache keys."""
+        return {
+            "model_name": self.model_name,
+            "batch_size": self.batch_size,
+            "table_settings": self.table_settings,
+            "prompts": [TABLE_PROMPT, TABLE_BATCH_PROMPT]
+        }
+
+    async def async_extract(self, pdf_bytes: bytes) -> Dict[str, Any]:
+        """Extract and structure table content using LLM.
+
+        ``unstructured_tables`` counts tables the LLM failed to structure, and
+        ``error`` is set when extraction failed altogether.
+        """
         tables = []
+        unstructured_tables = 0
         
         try:
-            with pdfplumber.open(file_path) as pdf:
-                for page_num, page in enumerate(pdf.pages, 1):
-                    page_tables = page.extract_tables()
-                    
-                    for table_num, table in enumerate(page_tables, 1):
-                        if not table:
-                            continue
-                        
-                        # Convert raw table to text format for LLM
-                        table_text = self._format_table_for_llm(table)
-                        
-                        # Process with LLM for structure
-                        structured_table = await self._process_table_with_llm(table_text)
-                        
-                        if structured_table["success"]:
-                            tables.append({
-                                "page_number": page_num,
-                                "table_number": table_num,
-                                "structured_data": structured_table["structured_data"],
-                                "metadata": {
-                                    "row_count": len(table),
-                                    "column_count": len(table[0]) if table else 0
-                                }
-                            })
+            # Collect every table first so they can be structured in batches;
+            # pdfplumber parsing is CPU-bound, so keep it off the event loop
+            raw_tables = await asyncio.to_thread(self._collect_tables, pdf_bytes)
+            
+            for start in range(0, len(raw_tables), self.batch_size):
+                batch = raw_tables[start:start + self.batch_size]
+                
+                # Process with LLM for structure
+                structured_tables = await self._process_tables_with_llm(
+                    [table_text for _, _, _, table_text in batch]
+                )
+                
+                for (page_num, table_num, table, _), structured_table in zip(batch, structured_tables):
+                    if not structured_table["success"] or not structured_table.get("structured", True):
+                        unstructured_tables += 1
+                    if structured_table["success"]:
+                        tables.append({
+                            "page_number": page_num,
+                            "table_number": table_num,
+                            "structured_data": structured_table["structured_data"],
+                            "metadata": {
+                                "row_count": len(table),
+                                "column_count": len(table[0]) if table else 0
+                            }
+                        })
             
-            return {"tables": tables}
+            return {"tables": tables, "unstructured_tables": unstructured_tables}
             
         except Exception as e:
             print(f"Error extracting tables: {str(e)}")
-            return {"tables": []}
+            return {"tables": [], "error": str(e)}
+
+    def _collect_tables(self, pdf_bytes: bytes) -> List[Tuple[int, int, List[List[str]], str]]:
+        """Read every non-empty table as (page_num, table_num, table, table_text)."""
+        raw_tables = []
+        with pdfplumber.open(io.BytesIO(pdf_bytes)) as pdf:
+            for page_num, page in enumerate(pdf.pages, 1):
+                page_tables = page.extract_tables()
+                
+                for table_num, table in enumerate(page_tables, 1):
+                    if not table:
+                        continue
+                    
+                    # Convert raw table to text format for LLM
+                    table_text = self._format_table_for_llm(table)
+                    raw_tables.append((page_num, table_num, table, table_text))
+        return raw_tables
 
     def _format_table_for_llm(self, table: List[List[str]]) -> str:
         """Format table data for LLM processing."""
@@ -75,17 +127,38 @@ class TableExtractor:
                 formatted_rows.append(" | ".join(cleaned_row))
         return "\n".join(formatted_rows)
 
-    async def _process_table_with_llm(self, table_text: str) -> Dict[str, Any]:
-        """Process table text with LLM for structured understanding."""
+    async def _process_tables_with_llm(self, table_texts: List[str]) -> List[Dict[str, Any]]:
+        """Process several tables in a single LLM call, one result per table."""
+        if len(table_texts) == 1:
+            return [await self._process_table_with_llm(table_texts[0])]
+        
         try:
-            prompt = f"""Please analyze this table data and convert it into a structured format.
-            Focus on identifying headers and organizing the data appropriately.
+            numbered_tables = "\n\n".join(
+                f"Table {i}:\n{table_text}" for i, table_text in enumerate(table_texts, 1)
+            )
+            prompt = TABLE_BATCH_PROMPT.format(count=len(table_texts), numbered_tables=numbered_tables)
 
-            Table Data:
-            {table_text}
+            response = await self.llm.ainvoke(prompt)
+            structured_tables = json.loads(response.content)
+            if isinstance(structured_tables, list) and len(structured_tables) == len(table_texts):
+                return [
+                    {"success": True, "structured_data": structured_data}
+                    for structured_data in structured_tables
+                ]
+            print("Batched table response did not match the table count, retrying per table")
+            
+        except json.JSONDecodeError:
+            print("Batched table response was not valid JSON, retrying per table")
+        except Exception as e:
+            print(f"Error processing table batch with LLM: {str(e)}")
+        
+        # Fall back to one call per table
+        return [await self._process_table_with_llm(table_text) for table_text in table_texts]
 
-            Convert this into a structured format with clear headers and data rows.
-            Return only the JSON structure without any explanation."""
+    async def _process_table_with_llm(self, table_text: str) -> Dict[str, Any]:
+        """Process table text with LLM for structured understanding."""
+        try:
+            prompt = TABLE_PROMPT.format(table_text=table_text)
 
             response = await self.llm.ainvoke(prompt)
             
@@ -97,6 +170,7 @@ class TableExtractor:
                 # If response isn't valid JSON, return a simplified structure
                 return {
                     "success": True,
+                    "structured": False,
                     "structured_data": {
                         "raw_text": table_text,
                         "rows": table_text.split("\n")
@@ -1,17 +1,30 @@
 """Module for extracting and structuring text content from PDFs."""
 
 import os
-from typing import Dict, Any
-from PyPDF2 import PdfReader
+import re
+import asyncio
+from typing import Dict, Any, List, TYPE_CHECKING
+
+from pdf_utils import PDFIUM_LOCK, page_count
+
+if TYPE_CHECKING:
+    import pypdfium2 as pdfium
+
+# Section numbers such as "2.", "3)" or "1.2.3" at the start of a line
+_NUMBERED_HEADING = re.compile(r"^(\d+(?:\.\d+)+\.?|\d+[.)])(?:\s|$)")
 
 class TextExtractor:
     """Handles extraction and structuring of textual content from PDFs."""
     
-    async def async_extract(self, file_path: str) -> Dict[str, Any]:
+    async def async_extract(self, pdf: "pdfium.PdfDocument") -> Dict[str, Any]:
         """Extract and structure text content with advanced hierarchy preservation."""
-        reader = PdfReader(file_path)
+        # Run off the event loop so extraction overlaps with the other extractors
+        return await asyncio.to_thread(self._extract, pdf)
+
+    def _extract(self, pdf: "pdfium.PdfDocument") -> Dict[str, Any]:
+        """Read every page with PDFium and structure its text."""
+        page_texts = self._read_page_texts(pdf)
         content = []
-        total_pages = len(reader.pages)
         statistics = {
             "total_words": 0,
             "total_paragraphs": 0,
@@ -21,94 +34,111 @@ class TextExtractor:
             "hierarchy_depth": 0,
         }
         
-        for page_num, page in enumerate(reader.pages, 1):
-            text = page.extract_text()
+        for page_num, text in enumerate(page_texts, 1):
             if not text:
                 continue
-                
-            lines = text.split('\n')
-            page_content = []
-            paragraph_buffer = []
-            
-            for line in lines:
-                line = line.strip()
-                if not line:
-                    if paragraph_buffer:
-                        # Process accumulated paragraph
-                        paragraph_text = " ".join(paragraph_buffer)
-                        page_content.append({
-                            "type": "paragraph",
-                            "text": paragraph_text
-                        })
-                        statistics["total_paragraphs"] += 1
-                        statistics["total_words"] += len(paragraph_text.split())
-                        paragraph_buffer = []
-                    continue
-                
-                if self._is_heading(line):
-                    # Process any accumulated paragraph before the heading
-                    if paragraph_buffer:
-                        paragraph_text = " ".join(paragraph_buffer)
-                        page_content.append({
-                            "type": "paragraph",
-                            "text": paragraph_text
-                        })
-                        statistics["total_paragraphs"] += 1
-                        statistics["total_words"] += len(paragraph_text.split())
-                        paragraph_buffer = []
-                    
-                    # Add the heading
+            content.extend(self._extract_page(page_num, text, statistics))
+        
+        return {
+            "content": content,
+            "statistics": statistics,
+            "total_pages": len(page_texts)
+        }
+
+    def _read_page_texts(self, pdf: "pdfium.PdfDocument") -> List[str]:
+        """Read the raw text of every page."""
+        page_texts = []
+        for index in range(page_count(pdf)):
+            # Lock per page so renders and other documents can interleave
+            with PDFIUM_LOCK:
+                page = pdf[index]
+                textpage = page.get_textpage()
+                page_texts.append(textpage.get_text_range())
+                textpage.close()
+                page.close()
+        return page_texts
+
+    def _extract_page(self, page_num: int, text: str, statistics: Dict[str, int]) -> List[Dict[str, Any]]:
+        """Split one page of text into headings and paragraphs."""
+        lines = text.split('\n')
+        page_content = []
+        paragraph_buffer = []
+        
+        for line in lines:
+            line = line.strip()
+            if not line:
+                if paragraph_buffer:
+                    # Process accumulated paragraph
+                    paragraph_text = " ".join(paragraph_buffer)
                     page_content.append({
-                        "type": "heading",
-                        "text": line,
-                        "level": self._determine_heading_level(line)
+                        "type": "paragraph",
+                        "text": paragraph_text,
+                        "page_number": page_num
                     })
-                    statistics["total_headings"] += 1
-                else:
-                    paragraph_buffer.append(line)
+                    statistics["total_paragraphs"] += 1
+                    statistics["total_words"] += len(paragraph_text.split())
+                    paragraph_buffer = []
+                continue
             
-            # Handle any remaining paragraph text
-            if paragraph_buffer:
-                paragraph_text = " ".join(paragraph_buffer)
+            if self._is_heading(line):
+                # Process any accumulated paragraph before the heading
+                if paragraph_buffer:
+                    paragraph_text = " ".join(paragraph_buffer)
+                    page_content.append({
+                        "type": "paragraph",
+                        "text": paragraph_text,
+                        "page_number": page_num
+                    })
+                    statistics["total_paragraphs"] += 1
+                    statistics["total_words"] += len(paragraph_text.split())
+                    paragraph_buffer = []
+                
+                # Add the heading
                 page_content.append({
-                    "type": "paragraph",
-                    "text": paragraph_text
+                    "type": "heading",
+                    "text": line,
+                    "level": self._determine_heading_level(line),
+                    "page_number": page_num
                 })
-                statistics["total_paragraphs"] += 1
-                statistics["total_words"] += len(paragraph_text.split())
-            
-            if page_content:
-                content.extend(page_content)
+                statistics["total_headings"] += 1
+            else:
+                paragraph_buffer.append(line)
         
-        return {
-            "content": content,
-            "statistics": statistics,
-            "total_pages": total_pages
-        }
+        # Handle any remaining paragraph text
+        if paragraph_buffer:
+            paragraph_text = " ".join(paragraph_buffer)
+            page_content.append({
+                "type": "paragraph",
+                "text": paragraph_text,
+                "page_number": page_num
+            })
+            statistics["total_paragraphs"] += 1
+            statistics["total_words"] += len(paragraph_text.split())
+        
+        return page_content
     
     def _is_heading(self, line: str) -> bool:
         """Identify if a line is a heading."""
+        line = line.strip()
         if not line:
             return False
-        line = line.strip()
         # Check for common heading patterns
-        if len(line.split()) <= 10 and (
+        return len(line.split()) <= 10 and bool(
             line.isupper() or
             line.istitle() or
-            any(char.isdigit() and char + "." in line for char in "123456789") or
+            _NUMBERED_HEADING.match(line) or
             line.endswith(":") or
             len(line) < 100 and line[0].isupper()
-        ):
-            return True
-        return False
+        )
 
     def _determine_heading_level(self, heading: str) -> int:
         """Determine the hierarchy level of a heading."""
         heading = heading.strip()
         # Basic heading level detection rules
-        if any(char.isdigit() and char + "." in heading for char in "123456789"):
+        numbered = _NUMBERED_HEADING.match(heading)
+        if numbered:
             # Count the number of dot-separated numbers
-            return len([p for p in heading.split(".") if p and p[0].isdigit()])
+            return numbered.group(1).rstrip(".)").count(".") + 1
         if heading.isupper():
             return 1
         if heading.istitle() and len(heading) < 50:
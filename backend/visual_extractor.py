@@ -1,68 +1,135 @@
 """Module for extracting and processing visual content from PDFs."""
 
 import os
-from typing import Dict, Any, Optional
+import asyncio
+import queue
+import threading
+from typing import Dict, Any, List, Optional, Tuple, TYPE_CHECKING
 import numpy as np
-import cv2
 from PIL import Image
-import pytesseract
-from pdf2image import convert_from_path
+
+from pdf_utils import PDFIUM_LOCK, page_count
+
+# OpenCV, Tesseract and PDFium bindings are imported on first use
+if TYPE_CHECKING:
+    import pypdfium2 as pdfium
+    from tesserocr import PyTessBaseAPI
+
+# Optional EAST text detector; when present only detected text regions are OCR'd
+EAST_MODEL_PATH = os.path.join(os.path.dirname(__file__), "models", "frozen_east_text_detection.pb")
 
 class VisualExtractor:
     """Handles extraction and processing of images and graphs from PDFs."""
     
-    def __init__(self, ocr_dpi: int = 300):
-        """Initialize with OCR configuration."""
+    def __init__(
+        self,
+        ocr_dpi: int = 300,
+        triage_dpi: int = 150,
+        detect_max_side: int = 800,
+        min_edge_pixels: int = 500,
+        min_text_edge_density: float = 0.005,
+        text_detector_path: str = EAST_MODEL_PATH,
+        page_queue_size: int = 4
+    ):
+        """Initialize with OCR, triage and graph detection configuration."""
         self.ocr_dpi = ocr_dpi
+        # Pages are first rendered at triage_dpi; only pages worth OCR are re-rendered at ocr_dpi
+        self.triage_dpi = triage_dpi
+        # Edge detection runs on a downscaled copy of the page
+        self.detect_max_side = detect_max_side
+        self.min_edge_pixels = min_edge_pixels
+        # Fraction of edge pixels below which a page is treated as blank
+        self.min_text_edge_density = min_text_edge_density
+        self.max_workers = os.cpu_count() or 1
+        self.page_queue_size = page_queue_size
+        # Tesseract variables per region type, applied on top of the defaults
+        self.ocr_defaults = {
+            'tessedit_char_whitelist': '',
+            'preserve_interword_spaces': '0'
+        }
         self.ocr_config = {
-            'text': '--oem 3 --psm 6',
-            'graph': '--oem 3 --psm 6 -c tessedit_char_whitelist="0123456789.%-abcdefghijklmnopqrstuvwxyzABCDEFGHIJKLMNOPQRSTUVWXYZ"',
-            'table': '--oem 3 --psm 6 -c preserve_interword_spaces=1'
+            'text': {},
+            'graph': {'tessedit_char_whitelist': '0123456789.%-abcdefghijklmnopqrstuvwxyzABCDEFGHIJKLMNOPQRSTUVWXYZ'},
+            'table': {'preserve_interword_spaces': '1'}
         }
+        # Tesseract APIs are not thread-safe, so each worker borrows its own
+        self._ocr_apis: "queue.SimpleQueue[PyTessBaseAPI]" = queue.SimpleQueue()
+        self._text_detector = self._load_text_detector(text_detector_path)
+        self._text_detector_lock = threading.Lock()
 
-    async def async_extract(self, file_path: str) -> Dict[str, Any]:
+    @property
+    def settings(self) -> Dict[str, Any]:
+        """Settings that shape the extracted visual elements, for cache keys."""
+        return {
+            "ocr_dpi": self.ocr_dpi,
+            "triage_dpi": self.triage_dpi,
+            "detect_max_side": self.detect_max_side,
+            "min_edge_pixels": self.min_edge_pixels,
+            "min_text_edge_density": self.min_text_edge_density,
+            "ocr_defaults": self.ocr_defaults,
+            "ocr_config": self.ocr_config,
+            "text_detector": self._text_detector is not None
+        }
+
+    async def async_extract(self, pdf: "pdfium.PdfDocument") -> Dict[str, Any]:
         """Extract and process images and graphs with OCR."""
         try:
-            images = convert_from_path(file_path, dpi=self.ocr_dpi)
+            total_pages = await asyncio.to_thread(page_count, pdf)
+            results: List[Tuple[Optional[str], Optional[Dict[str, Any]]]] = [(None, None)] * total_pages
+            # Bounded hand-off so only a few rendered pages are held in memory at once
+            pages: "asyncio.Queue[Optional[Tuple[int, Image.Image]]]" = asyncio.Queue(maxsize=self.page_queue_size)
+            failed_pages = 0
+            
+            async def produce() -> None:
+                # Render in-process with PDFium instead of shelling out to pdftoppm
+                try:
+                    for index in range(total_pages):
+                        img = await asyncio.to_thread(self._render_page, pdf, index, self.triage_dpi)
+                        await pages.put((index + 1, img))
+                finally:
+                    # One stop signal per consumer, even if rendering failed
+                    for _ in range(self.max_workers):
+                        await pages.put(None)
+            
+            async def consume() -> None:
+                nonlocal failed_pages
+                while (item := await pages.get()) is not None:
+                    page_num, img = item
+                    try:
+                        results[page_num - 1] = await asyncio.to_thread(self._process_page, pdf, page_num, img)
+                    except Exception as e:
+                        print(f"Error processing page {page_num}: {str(e)}")
+                        failed_pages += 1
+                    del img, item
+            
+            # OCR pages concurrently, bounded by the number of CPU cores; wait for every
+            # consumer to finish before the shared document can be closed
+            render_error, *_ = await asyncio.gather(
+                produce(), *[consume() for _ in range(self.max_workers)], return_exceptions=True
+            )
+            if render_error:
+                raise render_error
+            
             visual_elements = {
                 "images": [],
                 "graphs": [],
                 "statistics": {
                     "total_images": 0,
                     "total_graphs": 0,
-                    "total_text_extracted": 0
+                    "total_text_extracted": 0,
+                    "failed_pages": failed_pages
                 }
             }
             
-            for page_num, img in enumerate(images, 1):
-                # Convert PIL Image to numpy array for OpenCV processing
-                img_array = np.array(img)
-                # Check if image contains a graph
-                graph_data = self._detect_and_process_graph(img_array)
-                
-                if graph_data:
-                    # Process graph
-                    graph_text = self._extract_text_from_region(img, self.ocr_config['graph'])
-                    visual_elements["graphs"].append({
-                        "page_number": page_num,
-                        "graph_data": graph_data,
-                        "extracted_text": graph_text,
-                        "type": graph_data["graph_type"]
-                    })
+            for kind, element in results:
+                if kind == "graph":
+                    visual_elements["graphs"].append(element)
                     visual_elements["statistics"]["total_graphs"] += 1
-                    visual_elements["statistics"]["total_text_extracted"] += len(graph_text.split())
-                else:
-                    # Process as regular image
-                    ocr_text = self._extract_text_from_region(img, self.ocr_config['text'])
-                    if ocr_text.strip():
-                        visual_elements["images"].append({
-                            "page_number": page_num,
-                            "extracted_text": ocr_text,
-                            "word_count": len(ocr_text.split()),
-                            "type": "image"
-                        })
-                        visual_elements["statistics"]["total_images"] += 1
-                        visual_elements["statistics"]["total_text_extracted"] += len(ocr_text.split())
+                    visual_elements["statistics"]["total_text_extracted"] += len(element["extracted_text"].split())
+                elif kind == "image":
+                    visual_elements["images"].append(element)
+                    visual_elements["statistics"]["total_images"] += 1
+                    visual_elements["statistics"]["total_text_extracted"] += element["word_count"]
             
             return visual_elements
             
@@ -79,39 +146,173 @@ class VisualExtractor:
                 }
             }
 
-    def _extract_text_from_region(self, image: Image.Image, config: str) -> str:
+    def _render_page(self, pdf: "pdfium.PdfDocument", index: int, dpi: int) -> Image.Image:
+        """Render one page to an RGB image at the given resolution."""
+        with PDFIUM_LOCK:
+            page = pdf[index]
+            try:
+                return page.render(scale=dpi / 72).to_pil()
+            finally:
+                page.close()
+
+    def _process_page(
+        self, pdf: "pdfium.PdfDocument", page_num: int, preview: Image.Image
+    ) -> Tuple[Optional[str], Optional[Dict[str, Any]]]:
+        """Classify a page from its low-resolution preview and OCR it if worthwhile."""
+        import cv2
+        
+        # Convert PIL Image to numpy array for OpenCV processing
+        edges, scale = self._edge_map(np.asarray(preview))
+        # Skip blank pages without touching Tesseract
+        if cv2.countNonZero(edges) < self.min_text_edge_density * edges.size:
+            return None, None
+        
+        # Check if image contains a graph; coordinates are mapped to OCR resolution
+        graph_data = self._detect_and_process_graph(edges, scale * self.triage_dpi / self.ocr_dpi)
+        img = self._render_page(pdf, page_num - 1, self.ocr_dpi)
+        
+        if graph_data:
+            # Process graph
+            graph_text = self._extract_text_from_region(img, self.ocr_config['graph'])
+            return "graph", {
+                "page_number": page_num,
+                "graph_data": graph_data,
+                "extracted_text": graph_text,
+                "type": graph_data["graph_type"]
+            }
+        
+        # Process as regular image
+        ocr_text = self._extract_text_from_regions(img)
+        if ocr_text.strip():
+            return "image", {
+                "page_number": page_num,
+                "extracted_text": ocr_text,
+                "word_count": len(ocr_text.split()),
+                "type": "image"
+            }
+        return None, None
+
+    def _edge_map(self, image: np.ndarray) -> Tuple[np.ndarray, float]:
+        """Compute Canny edges on a copy downscaled to detect_max_side.
+
+        Returns the edge map and the downscale factor that was applied.
+        """
+        import cv2
+        
+        scale = min(1.0, self.detect_max_side / max(image.shape[:2]))
+        if scale < 1.0:
+            image = cv2.resize(image, None, fx=scale, fy=scale, interpolation=cv2.INTER_AREA)
+        gray = cv2.cvtColor(image, cv2.COLOR_RGB2GRAY)
+        return cv2.Canny(gray, 50, 150, apertureSize=3), scale
+
+    def _load_text_detector(self, model_path: str) -> Optional[Any]:
+        """Load the EAST text detector if its model file is available."""
+        if not os.path.exists(model_path):
+            return None
+        import cv2
+        
+        try:
+            detector = cv2.dnn_TextDetectionModel_EAST(model_path)
+            detector.setConfidenceThreshold(0.5)
+            detector.setNMSThreshold(0.4)
+            # Input is RGB already, so no channel swap
+            detector.setInputParams(1.0, (768, 1024), (123.68, 116.78, 103.94), False)
+            return detector
+        except Exception as e:
+            print(f"Error loading text detector: {str(e)}")
+            return None
+
+    def _detect_text_regions(self, image: np.ndarray) -> Optional[List[Tuple[int, int, int, int]]]:
+        """Find text blocks as (x, y, w, h) boxes, or None when no detector is loaded."""
+        if self._text_detector is None:
+            return None
+        import cv2
+        
+        try:
+            # cv2.dnn networks are not safe to run concurrently
+            with self._text_detector_lock:
+                quads, _ = self._text_detector.detect(image)
+        except Exception as e:
+            print(f"Text detection error: {str(e)}")
+            return None
+        
+        # Merge word boxes into text blocks so Tesseract sees whole lines
+        mask = np.zeros(image.shape[:2], dtype=np.uint8)
+        for quad in quads:
+            x, y, w, h = cv2.boundingRect(np.asarray(quad, dtype=np.int32))
+            cv2.rectangle(mask, (x, y), (x + w, y + h), 255, thickness=-1)
+        mask = cv2.dilate(mask, cv2.getStructuringElement(cv2.MORPH_RECT, (25, 9)))
+        contours, _ = cv2.findContours(mask, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
+        # Reading order: top to bottom, then left to right
+        return sorted((cv2.boundingRect(c) for c in contours), key=lambda box: (box[1], box[0]))
+
+    def _extract_text_from_regions(self, image: Image.Image) -> str:
+        """OCR only the detected text regions of a page, or the whole page without a detector."""
+        regions = self._detect_text_regions(np.asarray(image))
+        if regions is None:
+            return self._extract_text_from_region(image, self.ocr_config['text'])
+        
+        texts = []
+        for x, y, w, h in regions:
+            text = self._extract_text_from_region(image.crop((x, y, x + w, y + h)), self.ocr_config['text'])
+            if text:
+                texts.append(text)
+        return "\n".join(texts)
+
+    def _extract_text_from_region(self, image: Image.Image, config: Dict[str, str]) -> str:
         """Extract text from an image region using OCR."""
+        from tesserocr import PyTessBaseAPI, PSM, OEM
+        
+        api = None
         try:
-            return pytesseract.image_to_string(image, config=config).strip()
+            try:
+                api = self._ocr_apis.get_nowait()
+            except queue.Empty:
+                api = PyTessBaseAPI(psm=PSM.SINGLE_BLOCK, oem=OEM.DEFAULT)
+            for name, value in {**self.ocr_defaults, **config}.items():
+                api.SetVariable(name, value)
+            api.SetImage(image)
+            return api.GetUTF8Text().strip()
         except Exception as e:
             print(f"OCR error: {str(e)}")
             return ""
+        finally:
+            if api is not None:
+                self._ocr_apis.put(api)
+
+    def _detect_and_process_graph(self, edges: np.ndarray, scale: float) -> Optional[Dict[str, Any]]:
+        """Detect and analyze graph elements in a page's edge map.
 
-    def _detect_and_process_graph(self, image: np.ndarray) -> Optional[Dict[str, Any]]:
-        """Detect and analyze graph elements in the image."""
+        ``scale`` is the size of the edge map relative to the page at ocr_dpi;
+        Hough parameters are tuned for that full resolution.
+        """
+        import cv2
+        
         try:
-            gray = cv2.cvtColor(image, cv2.COLOR_RGB2GRAY)
-            edges = cv2.Canny(gray, 50, 150, apertureSize=3)
+            # Fast reject for pages with almost no edges
+            if cv2.countNonZero(edges) < self.min_edge_pixels:
+                return None
             
             # Detect lines using Hough transform
-            lines = cv2.HoughLinesP(edges, 1, np.pi/180, 100, minLineLength=100, maxLineGap=10)
+            lines = cv2.HoughLinesP(
+                edges, 1, np.pi/180,
+                max(1, int(100 * scale)),
+                minLineLength=max(1, int(100 * scale)),
+                maxLineGap=max(1, int(10 * scale))
+            )
             
             if lines is None:
                 return None
                 
-            horizontal_lines = []
-            vertical_lines = []
-            
-            # Analyze line orientations
-            for line in lines:
-                x1, y1, x2, y2 = line[0]
-                angle = abs(np.arctan2(y2-y1, x2-x1) * 180 / np.pi)
-                
-                # Classify lines as horizontal or vertical
-                if angle < 10 or angle > 170:
-                    horizontal_lines.append((x1, y1, x2, y2))
-                elif 80 < angle < 100:
-                    vertical_lines.append((x1, y1, x2, y2))
+            # Classify lines as horizontal or vertical by orientation,
+            # in full-resolution coordinates
+            segments = lines[:, 0] / scale
+            angles = np.abs(np.degrees(np.arctan2(
+                segments[:, 3] - segments[:, 1],
+                segments[:, 2] - segments[:, 0]
+            )))
+            horizontal_lines = segments[(angles < 10) | (angles > 170)]
+            vertical_lines = segments[(angles > 80) & (angles < 100)]
             
             # Check for sufficient graph elements
             if len(horizontal_lines) >= 2 and len(vertical_lines) >= 2:
@@ -131,12 +332,15 @@ class VisualExtractor:
             print(f"Graph detection error: {str(e)}")
             return None
 
-    def _determine_graph_type(self, horizontal_lines: list, vertical_lines: list) -> str:
-        """Determine the type of graph based on detected elements."""
+    def _determine_graph_type(self, horizontal_lines: np.ndarray, vertical_lines: np.ndarray) -> str:
+        """Determine the type of graph based on detected elements.
+
+        Both arguments are (N, 4) arrays of x1, y1, x2, y2 line segments.
+        """
         try:
             # Calculate average spacing between lines
-            v_spacing = np.mean([abs(v1[0] - v2[0]) for v1, v2 in zip(vertical_lines[:-1], vertical_lines[1:])])
-            h_spacing = np.mean([abs(h1[1] - h2[1]) for h1, h2 in zip(horizontal_lines[:-1], horizontal_lines[1:])])
+            v_spacing = np.abs(np.diff(np.sort(vertical_lines[:, 0]))).mean()
+            h_spacing = np.abs(np.diff(np.sort(horizontal_lines[:, 1]))).mean()
             
             if abs(v_spacing - h_spacing) < 10:
                 return "grid_chart"
@@ -26,6 +26,7 @@ export default function Home() {
   const [processing, setProcessing] = useState(false)
   const [chatHistory, setChatHistory] = useState<Array<{ role: string; content: string; sources?: Array<{ page: number }> }>>([])
   const [question, setQuestion] = useState("")
+  const [sessionId, setSessionId] = useState<string | null>(null)
   const [darkMode, setDarkMode] = useState(true)
   const [mobileMenuOpen, setMobileMenuOpen] = useState(false)
 
@@ -57,7 +58,8 @@ export default function Home() {
         body,
       })
       if (!res.ok) throw new Error("Failed to process PDF")
-      await res.text()
+      const data = await res.json()
+      setSessionId(data.session_id)
     } catch (e) {
       alert((e as Error).message)
     } finally {
@@ -73,7 +75,10 @@ export default function Home() {
     try {
       const res = await fetch("http://127.0.0.1:7860/chat", {
         method: "POST",
-        headers: { "Content-Type": "application/json" },
+        headers: {
+          "Content-Type": "application/json",
+          ...(sessionId ? { "X-Session-Id": sessionId } : {}),
+        },
         body: JSON.stringify({ question }),
       })
       const data = await res.json()